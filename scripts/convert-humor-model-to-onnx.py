@@ -5,21 +5,67 @@ which can be used by Transformers.js without requiring API tokens.
 
 Requirements:
     pip install transformers torch onnx optimum[exporters]
+    pip install onnxconverter-common  # Only for --fp16
+    pip install peft                  # Only for --lora-path
+    pip install datasets              # Only for --quantize-static
+    pip install hf_transfer           # Optional: faster model downloads
 
 Usage:
     python convert-humor-model-to-onnx.py              # Convert base model
     python convert-humor-model-to-onnx.py --custom     # Convert fine-tuned model
+    python convert-humor-model-to-onnx.py --quantize   # Also emit a dynamic INT8 model
+    python convert-humor-model-to-onnx.py --quantize-static  # Also emit a calibrated static INT8 model
+    python convert-humor-model-to-onnx.py --no-optimize  # Skip the graph optimization pass
+    python convert-humor-model-to-onnx.py --fp16       # Also emit an FP16 model for GPU inference
+    python convert-humor-model-to-onnx.py --lora-path models/humor-detector-custom  # Merge LoRA adapter
 """
 
 import os
 import sys
+import json
 import argparse
+import platform
 from pathlib import Path
 
-def convert_model(custom=False):
+# Use the Rust-based downloader for Hub files when it's installed (must be set before importing HF libs)
+try:
+    import hf_transfer  # noqa: F401
+    os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+except ImportError:
+    pass
+
+# Sample texts used to sanity-check predictions after conversion
+TEST_TEXTS = [
+    "This is hilarious! I can't stop laughing!",
+    "The quarterly financial report shows steady growth.",
+    "Why did the chicken cross the road? To get to the other side!",
+]
+
+def load_calibration_texts(path, limit=100):
+    """Read up to `limit` calibration texts from a JSONL file ({"text": ...}) or a plain
+    text file (one per line). Falls back to TEST_TEXTS if the file doesn't exist."""
+    if not path or not os.path.exists(path):
+        print(f"   ⚠️  Calibration data not found ({path}), calibrating on the built-in test texts")
+        return list(TEST_TEXTS)
+    
+    texts = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            texts.append(json.loads(line)['text'] if path.endswith('.jsonl') else line)
+            if len(texts) >= limit:
+                break
+    return texts
+
+def convert_model(custom=False, quantize=False, optimize=True, fp16=False, lora_path=None,
+                  quantize_static=False, calibration_data=None):
     try:
         from transformers import AutoTokenizer, AutoModelForSequenceClassification
         from optimum.onnxruntime import ORTModelForSequenceClassification
+        from optimum.exporters.onnx import onnx_export_from_model
+        import numpy as np
         import torch
         print("✓ All required packages imported successfully")
     except ImportError as e:
@@ -28,8 +74,12 @@ def convert_model(custom=False):
         print("  pip install transformers torch onnx optimum[exporters]")
         sys.exit(1)
 
-    # Model to convert - base or custom fine-tuned
-    if custom:
+    # Model to convert - base, custom fine-tuned, or base + LoRA adapter (merged in Step 1)
+    if lora_path:
+        MODEL_NAME = lora_path
+        OUTPUT_DIR = Path("models/humor-detector-custom-onnx")
+        print(f"\n🎯 Converting LoRA adapter: {lora_path}")
+    elif custom:
         MODEL_NAME = "models/humor-detector-custom"
         OUTPUT_DIR = Path("models/humor-detector-custom-onnx")
         print("\n🎯 Converting CUSTOM fine-tuned model")
@@ -47,44 +97,201 @@ def convert_model(custom=False):
     try:
         # Step 1: Load the original model
         print("1️⃣  Loading original PyTorch model...")
-        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-        model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME)
+        if lora_path:
+            # Fold the adapter into the base weights so the export is a single plain graph
+            from peft import PeftConfig, PeftModel
+            
+            base_name = PeftConfig.from_pretrained(lora_path).base_model_name_or_path
+            tokenizer = AutoTokenizer.from_pretrained(lora_path)
+            base = AutoModelForSequenceClassification.from_pretrained(base_name)
+            model = PeftModel.from_pretrained(base, lora_path).merge_and_unload()
+            print(f"   ✓ Merged adapter into {base_name}")
+        else:
+            tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+            model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME)
         print("   ✓ Model loaded successfully")
         
-        # Step 2: Export to ONNX format using Optimum
+        # Step 2: Export the already-loaded model to ONNX format using Optimum
+        # Opset 17 keeps LayerNormalization as a single op instead of decomposing it
         print("\n2️⃣  Converting to ONNX format...")
+        onnx_export_from_model(
+            model,
+            output=OUTPUT_DIR,
+            task="text-classification",
+            opset=17
+        )
+        # Name the file explicitly: re-runs leave the optimized/quantized/FP16 variants alongside it
         onnx_model = ORTModelForSequenceClassification.from_pretrained(
-            MODEL_NAME,
-            export=True
+            OUTPUT_DIR,
+            file_name="model.onnx"
         )
         print("   ✓ Conversion successful")
         
-        # Step 3: Save the ONNX model and tokenizer
+        # Step 3: Save the tokenizer next to the exported ONNX model
         print("\n3️⃣  Saving ONNX model and tokenizer...")
-        onnx_model.save_pretrained(OUTPUT_DIR)
         tokenizer.save_pretrained(OUTPUT_DIR)
         print(f"   ✓ Saved to {OUTPUT_DIR.absolute()}")
         
+        # Test variants: (label, model) pairs compared side by side in Step 4
+        variants = [("FP32", onnx_model)]
+        
+        # Graph that later steps (quantization) build on
+        source_file = "model.onnx"
+        
+        # Step 3a: Graph optimization (LayerNorm/GELU/Attention fusion, constant folding)
+        if optimize:
+            print("\n3️⃣a Optimizing ONNX graph...")
+            from optimum.onnxruntime import ORTOptimizer
+            from optimum.onnxruntime.configuration import OptimizationConfig
+            
+            optimization_config = OptimizationConfig(
+                optimization_level=99,
+                optimize_for_gpu=False,
+                fp16=False,
+                enable_transformers_specific_optimizations=True
+            )
+            optimizer = ORTOptimizer.from_pretrained(OUTPUT_DIR, file_names=["model.onnx"])
+            optimizer.optimize(
+                save_dir=OUTPUT_DIR,
+                optimization_config=optimization_config,
+                file_suffix="optimized"
+            )
+            source_file = "model_optimized.onnx"
+            print(f"   ✓ Saved {source_file}")
+            
+            optimized_model = ORTModelForSequenceClassification.from_pretrained(
+                OUTPUT_DIR,
+                file_name=source_file
+            )
+            variants.append(("FP32 optimized", optimized_model))
+        
+        # Step 3b: Dynamic INT8 quantization (weights only) for CPU inference
+        if quantize:
+            print("\n3️⃣b Quantizing to dynamic INT8...")
+            from optimum.onnxruntime import ORTQuantizer
+            from optimum.onnxruntime.configuration import AutoQuantizationConfig
+            
+            if platform.machine().lower() in ("arm64", "aarch64"):
+                qconfig = AutoQuantizationConfig.arm64(is_static=False, per_channel=False)
+            else:
+                qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            
+            # Quantize the fused graph when available so the quantizer sees fused MatMuls
+            quantized_file = f"{Path(source_file).stem}_quantized.onnx"
+            quantizer = ORTQuantizer.from_pretrained(OUTPUT_DIR, file_name=source_file)
+            quantizer.quantize(save_dir=OUTPUT_DIR, quantization_config=qconfig)
+            
+            fp32_size = (OUTPUT_DIR / source_file).stat().st_size / 1e6
+            int8_size = (OUTPUT_DIR / quantized_file).stat().st_size / 1e6
+            print(f"   ✓ Saved {quantized_file} ({int8_size:.1f} MB vs {fp32_size:.1f} MB FP32)")
+            
+            quantized_model = ORTModelForSequenceClassification.from_pretrained(
+                OUTPUT_DIR,
+                file_name=quantized_file
+            )
+            variants.append(("INT8 dynamic", quantized_model))
+        
+        # Step 3c: Static INT8 quantization (weights + activations) calibrated on sample texts
+        if quantize_static:
+            print("\n3️⃣c Quantizing to static INT8...")
+            from datasets import Dataset
+            from optimum.onnxruntime import ORTQuantizer
+            from optimum.onnxruntime.configuration import AutoCalibrationConfig, AutoQuantizationConfig
+            
+            if platform.machine().lower() in ("arm64", "aarch64"):
+                qconfig = AutoQuantizationConfig.arm64(is_static=True, per_channel=True)
+            else:
+                qconfig = AutoQuantizationConfig.avx512_vnni(is_static=True, per_channel=True)
+            
+            calibration_texts = load_calibration_texts(calibration_data)
+            calibration_dataset = Dataset.from_dict({"text": calibration_texts}).map(
+                lambda examples: tokenizer(examples["text"], truncation=True),
+                batched=True,
+                remove_columns=["text"]
+            )
+            print(f"   Calibrating on {len(calibration_dataset)} texts...")
+            
+            static_file = f"{Path(source_file).stem}_int8_static.onnx"
+            quantizer = ORTQuantizer.from_pretrained(OUTPUT_DIR, file_name=source_file)
+            # Calibration writes a full-size augmented copy of the graph; keep it out of the cwd
+            augmented_path = OUTPUT_DIR / "augmented_model.onnx"
+            calibration_ranges = quantizer.fit(
+                dataset=calibration_dataset,
+                calibration_config=AutoCalibrationConfig.minmax(calibration_dataset),
+                onnx_augmented_model_name=augmented_path,
+                operators_to_quantize=qconfig.operators_to_quantize
+            )
+            quantizer.quantize(
+                save_dir=OUTPUT_DIR,
+                quantization_config=qconfig,
+                calibration_tensors_range=calibration_ranges,
+                file_suffix="int8_static"
+            )
+            augmented_path.unlink(missing_ok=True)
+            
+            static_size = (OUTPUT_DIR / static_file).stat().st_size / 1e6
+            print(f"   ✓ Saved {static_file} ({static_size:.1f} MB)")
+            
+            static_model = ORTModelForSequenceClassification.from_pretrained(
+                OUTPUT_DIR,
+                file_name=static_file
+            )
+            variants.append(("INT8 static", static_model))
+        
+        # Step 3d: FP16 variant for GPU inference (CPU kernels mostly lack FP16, so predictions
+        # aren't compared in Step 4; the graph is validated and, on CUDA hosts, load-checked)
+        if fp16:
+            print("\n3️⃣d Converting to FP16...")
+            import onnx
+            import onnxruntime
+            from onnxconverter_common import float16
+            
+            fp16_path = OUTPUT_DIR / "model_fp16.onnx"
+            fp32_graph = onnx.load(str(OUTPUT_DIR / "model.onnx"))
+            fp16_graph = float16.convert_float_to_float16(fp32_graph, keep_io_types=True)
+            onnx.save(fp16_graph, str(fp16_path))
+            onnx.checker.check_model(str(fp16_path))
+            
+            fp16_size = fp16_path.stat().st_size / 1e6
+            print(f"   ✓ Saved model_fp16.onnx ({fp16_size:.1f} MB, passes onnx.checker)")
+            
+            if "CUDAExecutionProvider" in onnxruntime.get_available_providers():
+                onnxruntime.InferenceSession(str(fp16_path), providers=["CUDAExecutionProvider"])
+                print("   ✓ Loads with CUDAExecutionProvider")
+            else:
+                print("   ⚠️  CUDA execution provider not available, skipped the ONNX Runtime load check")
+        
         # Step 4: Test the converted model
         print("\n4️⃣  Testing converted model...")
-        test_texts = [
-            "This is hilarious! I can't stop laughing!",
-            "The quarterly financial report shows steady growth.",
-            "Why did the chicken cross the road? To get to the other side!",
-        ]
+        test_texts = TEST_TEXTS
         
-        for text in test_texts:
-            inputs = tokenizer(text, return_tensors="pt")
-            outputs = onnx_model(**inputs)
-            logits = outputs.logits
-            predicted_class = torch.argmax(logits, dim=1).item()
-            probabilities = torch.nn.functional.softmax(logits, dim=1)[0]
-            
-            label = model.config.id2label[predicted_class]
-            confidence = probabilities[predicted_class].item()
+        # Fixed-shape int64 input buffers, allocated once and bound to every variant's session
+        encoded = tokenizer(test_texts, return_tensors="np", padding="max_length",
+                            truncation=True, max_length=128)
+        input_buffers = {name: np.ascontiguousarray(values, dtype=np.int64)
+                         for name, values in encoded.items()}
+        
+        # Run all test texts through each variant in a single batched forward pass
+        results = []
+        for variant_name, variant_model in variants:
+            session = getattr(variant_model, "session", None) or variant_model.model
+            binding = session.io_binding()
+            for session_input in session.get_inputs():
+                binding.bind_cpu_input(session_input.name, input_buffers[session_input.name])
+            binding.bind_output("logits")
+            session.run_with_iobinding(binding)
+            logits = torch.from_numpy(binding.copy_outputs_to_cpu()[0])
             
+            probabilities = torch.softmax(logits, dim=1)
+            predicted = probabilities.argmax(dim=1)
+            confidences = probabilities.gather(1, predicted.unsqueeze(1)).squeeze(1)
+            results.append((variant_name, predicted.tolist(), confidences.tolist()))
+        
+        for i, text in enumerate(test_texts):
             print(f"\n   Text: \"{text[:60]}...\"")
-            print(f"   Prediction: {label} ({confidence:.3f})")
+            for variant_name, predicted, confidences in results:
+                label = model.config.id2label[predicted[i]]
+                print(f"   Prediction [{variant_name}]: {label} ({confidences[i]:.3f})")
         
         print("\n✅ Model conversion complete!")
         print(f"\n📝 Next steps:")
@@ -102,9 +309,23 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Convert humor model to ONNX')
     parser.add_argument('--custom', action='store_true', 
                         help='Convert custom fine-tuned model instead of base model')
+    parser.add_argument('--quantize', action='store_true',
+                        help='Also produce a dynamic INT8 model (*_quantized.onnx) for CPU inference')
+    parser.add_argument('--no-optimize', action='store_true',
+                        help='Skip the ONNX graph optimization pass (model_optimized.onnx)')
+    parser.add_argument('--fp16', action='store_true',
+                        help='Also produce an FP16 model (model_fp16.onnx) for GPU inference')
+    parser.add_argument('--lora-path',
+                        help='Merge this LoRA adapter into its base model before exporting')
+    parser.add_argument('--quantize-static', action='store_true',
+                        help='Also produce a calibrated static INT8 model (*_int8_static.onnx)')
+    parser.add_argument('--calibration-data', default='training-data.jsonl',
+                        help='JSONL ({"text": ...}) or text file with calibration samples for --quantize-static')
     args = parser.parse_args()
     
     print("🔄 Humor Detection Model Converter")
     print("=" * 50)
-    convert_model(custom=args.custom)
+    convert_model(custom=args.custom, quantize=args.quantize, optimize=not args.no_optimize,
+                  fp16=args.fp16, lora_path=args.lora_path,
+                  quantize_static=args.quantize_static, calibration_data=args.calibration_data)
 
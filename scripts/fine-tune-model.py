@@ -7,31 +7,52 @@ feedback data to create a custom model that matches your humor preferences.
 
 Requirements:
     pip install transformers torch datasets accelerate
+    pip install hf_transfer  # Optional: faster model downloads
 
 Usage:
     python scripts/fine-tune-model.py
     python scripts/fine-tune-model.py --data training-data.jsonl
     python scripts/fine-tune-model.py --epochs 5 --batch-size 8
     python scripts/fine-tune-model.py --gpu  # Use GPU if available
+    python scripts/fine-tune-model.py --gpu --precision bf16  # Mixed precision
+    python scripts/fine-tune-model.py --gpu --grad-accum 4  # Effective batch 4x larger
+    python scripts/fine-tune-model.py --gpu --optim adamw_bnb_8bit  # 8-bit optimizer state
+    python scripts/fine-tune-model.py --freeze-encoder --unfreeze-top-n 2  # Train head + top 2 layers
+    python scripts/fine-tune-model.py --lora --learning-rate 2e-4  # LoRA adapters (needs peft)
+    python scripts/fine-tune-model.py --max-length 64  # Fixed truncation length (default: auto)
+    python scripts/fine-tune-model.py --gpu --attn flash2  # FlashAttention-2 (needs flash-attn)
+    scripts/fine-tune-model.sh --epochs 5  # All local GPUs via torchrun (DDP)
+    python scripts/fine-tune-model.py --eval-steps 50 --eval-subsample 256  # Cheaper periodic eval
 
 The fine-tuned model will be saved to: models/humor-detector-custom/
 """
 
 import argparse
+import hashlib
 import json
 import os
 from pathlib import Path
 
+# Use the Rust-based downloader for Hub files when it's installed (must be set before importing HF libs)
+try:
+    import hf_transfer  # noqa: F401
+    os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+except ImportError:
+    pass
+
 try:
     from transformers import (
         AutoTokenizer,
         AutoModelForSequenceClassification,
         TrainingArguments,
         Trainer,
-        EarlyStoppingCallback
+        EarlyStoppingCallback,
+        DataCollatorWithPadding
     )
     from datasets import Dataset
+    import numpy as np
     import torch
+    from torch.utils.data import WeightedRandomSampler
 except ImportError as e:
     print("❌ Missing dependencies!")
     print("\nPlease install required packages:")
@@ -39,49 +60,147 @@ except ImportError as e:
     print(f"\nError: {e}")
     exit(1)
 
+# LoRA target modules (query/value projections) per architecture; others use PEFT's defaults
+LORA_TARGET_MODULES = {
+    'distilbert': ['q_lin', 'v_lin'],
+    'bert': ['query', 'value'],
+}
+
+# Optional: faster JSONL parsing (falls back to stdlib json)
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def load_training_data(data_path):
-    """Load and parse training data from JSONL file."""
+
+def load_training_data(data_path, interactive=True):
+    """Load training data from JSONL file into parallel text/label lists."""
     if not os.path.exists(data_path):
         print(f"❌ Training data not found: {data_path}")
         print("\nGenerate training data first:")
         print("  node scripts/export-training-data.js")
         exit(1)
     
-    data = []
-    with open(data_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            if line.strip():
-                data.append(json.loads(line))
+    # Read the file once and parse every non-blank line
+    loads = orjson.loads if orjson is not None else json.loads
+    raw = Path(data_path).read_bytes()
+    data = [loads(line) for line in raw.splitlines() if line.strip()]
+    
+    texts = [item['text'] for item in data]
+    labels = [item['label'] for item in data]
     
-    if len(data) < 20:
-        print(f"⚠️  Warning: Only {len(data)} training examples found.")
+    if len(texts) < 20:
+        print(f"⚠️  Warning: Only {len(texts)} training examples found.")
         print("   Recommendation: Collect 20-30+ feedback samples for best results.")
-        response = input("\nContinue anyway? (y/N): ")
-        if response.lower() != 'y':
-            exit(0)
+        if interactive:
+            response = input("\nContinue anyway? (y/N): ")
+            if response.lower() != 'y':
+                exit(0)
     
-    return data
+    return texts, labels
+
+
+def positive_int_arg(value):
+    """argparse type for options that must be a positive integer."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("must be an integer")
+    if number <= 0:
+        raise argparse.ArgumentTypeError("must be a positive integer")
+    return number
+
+
+def non_negative_int_arg(value):
+    """argparse type for options that must be zero or a positive integer."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("must be an integer")
+    if number < 0:
+        raise argparse.ArgumentTypeError("must not be negative")
+    return number
+
+
+def max_length_arg(value):
+    """argparse type for --max-length: 'auto' or a positive integer."""
+    if value == 'auto':
+        return value
+    try:
+        return positive_int_arg(value)
+    except argparse.ArgumentTypeError:
+        raise argparse.ArgumentTypeError("must be 'auto' or a positive integer")
+
 
+def tokenize_cache_file(data_path, *key_parts, kind='tok_cache'):
+    """Content-keyed Arrow cache path next to data_path, so re-exported data misses the cache."""
+    cache_key = hashlib.sha256(json.dumps(key_parts).encode('utf-8')).hexdigest()[:16]
+    data_file = Path(data_path)
+    return data_file.parent / f"{data_file.stem}.{cache_key}.{kind}.arrow"
 
-def prepare_dataset(data, tokenizer, val_split=0.1):
-    """Prepare train/validation datasets."""
+
+def map_cached(dataset, function, cache_file, batch_size=1000, **kwargs):
+    """Batched dataset.map backed by cache_file, using one worker per batch (up to 8)."""
+    num_proc = min(8, os.cpu_count() or 1, (len(dataset) + batch_size - 1) // batch_size)
+    return dataset.map(
+        function,
+        batched=True,
+        batch_size=batch_size,
+        num_proc=num_proc if num_proc > 1 else None,  # Tiny datasets tokenize in-process
+        load_from_cache_file=True,
+        cache_file_name=str(cache_file),
+        **kwargs
+    )
+
+
+def auto_max_length(texts, tokenizer, data_path, limit=128):
+    """Pick the truncation length as the 99th-percentile token length, rounded up to a
+    multiple of 8 and capped at limit. Lengths are cached like the tokenized data."""
+    def length_function(examples):
+        return {'length': [len(ids) for ids in tokenizer(examples['text'], truncation=False)['input_ids']]}
+
+    cache_file = tokenize_cache_file(data_path, tokenizer.name_or_path, texts, kind='lengths.tok_cache')
+    measured = map_cached(Dataset.from_dict({'text': texts}), length_function, cache_file,
+                          remove_columns=['text'])
+    lengths = np.asarray(measured['length'])
+
+    p99 = int(np.ceil(np.percentile(lengths, 99)))
+    max_length = min(max(8, (p99 + 7) // 8 * 8), limit)
+
+    print(f"  Token lengths: mean {lengths.mean():.0f}, max {lengths.max()}")
+    print(f"  Max length: {max_length} ({int((lengths > max_length).sum())} examples truncated)")
+    return max_length
+
+
+def prepare_dataset(texts, labels, tokenizer, data_path, max_length=128, val_split=0.1):
+    """Prepare train/validation datasets, caching the tokenized data next to data_path."""
     # Convert to Hugging Face Dataset
     dataset = Dataset.from_dict({
-        'text': [item['text'] for item in data],
-        'label': [item['label'] for item in data]
+        'text': texts,
+        'label': labels
     })
     
-    # Tokenize
+    # Tokenize (padding is applied per batch by the data collator)
     def tokenize_function(examples):
         return tokenizer(
             examples['text'],
-            padding='max_length',
             truncation=True,
-            max_length=128
+            max_length=max_length
         )
     
-    tokenized = dataset.map(tokenize_function, batched=True)
+    # Key the cache on content + tokenizer so re-exported data is re-tokenized
+    cache_file = tokenize_cache_file(data_path, tokenizer.name_or_path, max_length, texts, labels)
+    tokenized = map_cached(
+        dataset,
+        tokenize_function,
+        cache_file,
+        remove_columns=['text']  # Keep raw strings out of the cache and the dataloader
+    )
+    
+    # Hand tensors straight to the dataloader instead of converting per batch
+    columns = [c for c in ['input_ids', 'token_type_ids', 'attention_mask', 'label']
+               if c in tokenized.column_names]
+    tokenized.set_format('torch', columns=columns)
     
     # Split train/validation
     split = tokenized.train_test_split(test_size=val_split, seed=42)
@@ -89,21 +208,170 @@ def prepare_dataset(data, tokenizer, val_split=0.1):
     return split['train'], split['test']
 
 
+def freeze_encoder(model, unfreeze_top_n=0):
+    """Freeze the base encoder, leaving the classification head and top N layers trainable.
+
+    Returns (trainable, total) parameter counts.
+    """
+    num_layers = model.config.num_hidden_layers
+    top_layers = range(max(num_layers - unfreeze_top_n, 0), num_layers)
+
+    for name, param in model.base_model.named_parameters():
+        param.requires_grad = any(f"layer.{layer}." in name for layer in top_layers)
+
+    trainable = sum(p.numel() for p in model.parameters() if p.requires_grad)
+    total = sum(p.numel() for p in model.parameters())
+    return trainable, total
+
+
+def apply_lora(model, rank=8):
+    """Wrap the model with LoRA adapters so only the adapters and classifier are trained."""
+    try:
+        from peft import LoraConfig, get_peft_model
+    except ImportError:
+        print("❌ LoRA requires peft: pip install peft")
+        exit(1)
+
+    lora_config = LoraConfig(
+        r=rank,
+        lora_alpha=rank * 2,
+        target_modules=LORA_TARGET_MODULES.get(model.config.model_type),
+        lora_dropout=0.05,
+        task_type="SEQ_CLS"
+    )
+    return get_peft_model(model, lora_config)
+
+
+def compute_sample_weights(train_dataset):
+    """Per-example inverse class-frequency weights so both classes are drawn equally often."""
+    labels = torch.tensor(list(train_dataset.with_format(None)['label']))
+    counts = torch.bincount(labels, minlength=2).clamp(min=1)
+    class_weights = 1.0 / counts.double()
+    return class_weights[labels]
+
+
+class BalancedTrainer(Trainer):
+    """Trainer that samples training examples by the given weights (with replacement).
+
+    The weighted sampler replaces the LengthGroupedSampler, so group_by_length has no
+    effect when sample_weights is set.
+    """
+
+    def __init__(self, *args, sample_weights=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sample_weights = sample_weights
+
+    def _get_train_sampler(self, *args, **kwargs):
+        if self.sample_weights is None:
+            return super()._get_train_sampler(*args, **kwargs)
+        return WeightedRandomSampler(
+            self.sample_weights,
+            num_samples=len(self.sample_weights),
+            replacement=True
+        )
+
+
 def compute_metrics(eval_pred):
-    """Compute accuracy and F1 metrics."""
-    from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score
-    
+    """Compute accuracy and binary (HUMOR = positive) precision/recall/F1 metrics.
+
+    Matches sklearn's average='binary' output, with 0.0 where a ratio is undefined.
+    """
     predictions, labels = eval_pred
-    predictions = predictions.argmax(axis=-1)
+    predictions = np.asarray(predictions).argmax(axis=-1)
+    labels = np.asarray(labels)
+    
+    tp = int(((predictions == 1) & (labels == 1)).sum())
+    fp = int(((predictions == 1) & (labels == 0)).sum())
+    fn = int(((predictions == 0) & (labels == 1)).sum())
     
     return {
-        'accuracy': accuracy_score(labels, predictions),
-        'f1': f1_score(labels, predictions, average='binary'),
-        'precision': precision_score(labels, predictions, average='binary'),
-        'recall': recall_score(labels, predictions, average='binary')
+        'accuracy': float((predictions == labels).mean()),
+        'f1': 2 * tp / (2 * tp + fp + fn) if tp else 0.0,
+        'precision': tp / (tp + fp) if tp + fp else 0.0,
+        'recall': tp / (tp + fn) if tp + fn else 0.0
     }
 
 
+def resolve_precision(requested, device):
+    """Pick the mixed-precision mode for training.
+
+    Only the forward/backward runs in reduced precision; the model weights and
+    optimizer state stay FP32 (the Trainer handles autocast and, for fp16, the
+    GradScaler), so the model itself is never cast.
+    """
+    if requested == 'auto':
+        if device == 'cuda' and torch.cuda.is_bf16_supported():
+            return 'bf16'
+        return 'fp32'
+
+    if requested == 'bf16' and device == 'cuda' and not torch.cuda.is_bf16_supported():
+        print("⚠️  BF16 requested but not supported by this GPU, using FP32")
+        return 'fp32'
+
+    if requested == 'fp16' and device == 'cpu':
+        print("⚠️  FP16 requested but only supported on GPU, using FP32")
+        return 'fp32'
+
+    return requested
+
+
+def resolve_attention(requested, device, precision):
+    """Map --attn to a transformers attn_implementation, falling back to SDPA when
+    FlashAttention-2 can't run (needs flash-attn, an Ampere+ GPU and bf16/fp16).
+
+    'auto' returns None so transformers picks the best implementation the model supports.
+    """
+    if requested == 'auto':
+        return None
+
+    if requested != 'flash2':
+        return requested
+
+    if precision == 'fp32':
+        print("⚠️  FlashAttention-2 requires --precision bf16 or fp16, using SDPA")
+        return 'sdpa'
+
+    if device != 'cuda' or torch.cuda.get_device_capability()[0] < 8:
+        print("⚠️  FlashAttention-2 requires an Ampere or newer GPU, using SDPA")
+        return 'sdpa'
+
+    try:
+        import flash_attn  # noqa: F401
+    except ImportError:
+        print("⚠️  flash-attn not installed (pip install flash-attn), using SDPA")
+        return 'sdpa'
+
+    return 'flash_attention_2'
+
+
+def resolve_optimizer(requested, device):
+    """Pick the Trainer optimizer, falling back to FP32 AdamW if 8-bit AdamW can't run."""
+    if requested != 'adamw_bnb_8bit':
+        return requested
+
+    if device != 'cuda':
+        print("⚠️  8-bit AdamW requires a GPU, using FP32 AdamW")
+        return 'adamw_torch'
+
+    try:
+        import bitsandbytes  # noqa: F401
+    except ImportError:
+        print("⚠️  bitsandbytes not installed (pip install bitsandbytes), using FP32 AdamW")
+        return 'adamw_torch'
+
+    return requested
+
+
+def silence_non_main_ranks():
+    """Under torchrun, only the rank 0 process prints (same approach as torchvision's
+    reference scripts); other ranks would repeat the same banner and statistics."""
+    if int(os.environ.get("RANK", 0)) == 0:
+        return
+
+    import builtins
+    builtins.print = lambda *args, **kwargs: None
+
+
 def main():
     parser = argparse.ArgumentParser(description='Fine-tune humor detection model')
     parser.add_argument('--data', default='training-data.jsonl', help='Path to training data')
@@ -112,46 +380,125 @@ def main():
     parser.add_argument('--batch-size', type=int, default=8, help='Training batch size')
     parser.add_argument('--learning-rate', type=float, default=2e-5, help='Learning rate')
     parser.add_argument('--gpu', action='store_true', help='Use GPU if available')
+    parser.add_argument('--precision', choices=['auto', 'fp32', 'bf16', 'fp16'], default='auto',
+                        help='Training precision (auto = bf16 on supported GPUs, otherwise fp32)')
+    parser.add_argument('--attn', choices=['auto', 'eager', 'sdpa', 'flash2'], default='auto',
+                        help='Attention implementation (auto = transformers default, sdpa = fused PyTorch '
+                             'kernel, flash2 = FlashAttention-2)')
+    parser.add_argument('--optim', choices=['adamw_torch', 'adamw_bnb_8bit'], default='adamw_torch',
+                        help='Optimizer (adamw_bnb_8bit stores moments in 8-bit, needs bitsandbytes + GPU)')
+    parser.add_argument('--compile', action='store_true',
+                        help='Compile the model with torch.compile (pays off on large datasets on GPU)')
+    parser.add_argument('--freeze-encoder', action='store_true',
+                        help='Freeze the encoder and only train the classification head')
+    parser.add_argument('--unfreeze-top-n', type=non_negative_int_arg, default=0,
+                        help='With --freeze-encoder, also train the top N encoder layers')
+    parser.add_argument('--lora', action='store_true',
+                        help='Train LoRA adapters instead of the full model (needs peft)')
+    parser.add_argument('--lora-r', type=positive_int_arg, default=8, help='LoRA rank')
+    parser.add_argument('--max-length', type=max_length_arg, default='auto',
+                        help="Token truncation length, or 'auto' for the 99th percentile (default: auto)")
+    parser.add_argument('--balance-classes', action='store_true',
+                        help='Oversample the minority class so batches are class-balanced')
+    parser.add_argument('--eval-steps', type=positive_int_arg, default=None,
+                        help='Evaluate/checkpoint every N steps instead of every epoch')
+    parser.add_argument('--eval-subsample', type=positive_int_arg, default=256,
+                        help='Max validation examples used for evaluation during training '
+                             '(the final evaluation uses the full set)')
+    parser.add_argument('--grad-accum', type=positive_int_arg, default=1,
+                        help='Gradient accumulation steps (effective batch = batch size x steps)')
+    parser.add_argument('--grad-checkpoint', dest='grad_checkpoint', action='store_true', default=None,
+                        help='Enable gradient checkpointing (default: on for GPU, off for CPU)')
+    parser.add_argument('--no-grad-checkpoint', dest='grad_checkpoint', action='store_false',
+                        help='Disable gradient checkpointing')
     args = parser.parse_args()
     
+    if args.lora and (args.freeze_encoder or args.unfreeze_top_n > 0):
+        parser.error("--lora cannot be combined with --freeze-encoder/--unfreeze-top-n")
+    
+    # torchrun sets LOCAL_RANK; the Trainer then runs distributed data parallel across processes
+    local_rank = int(os.environ.get("LOCAL_RANK", -1))
+    distributed = local_rank != -1
+    silence_non_main_ranks()
+    
     print("=" * 70)
     print("FINE-TUNE HUMOR DETECTION MODEL")
     print("=" * 70)
     
     # Check for GPU
-    device = 'cuda' if args.gpu and torch.cuda.is_available() else 'cpu'
+    device = 'cuda' if (args.gpu or distributed) and torch.cuda.is_available() else 'cpu'
     print(f"\nDevice: {device}")
+    if distributed:
+        print(f"Distributed: {os.environ.get('WORLD_SIZE', '?')} processes")
     if args.gpu and not torch.cuda.is_available():
         print("⚠️  GPU requested but not available, using CPU")
     
+    precision = resolve_precision(args.precision, device)
+    print(f"Precision: {precision}")
+    
+    attn_implementation = resolve_attention(args.attn, device, precision)
+    print(f"Attention: {attn_implementation or 'auto'}")
+    
+    optim = resolve_optimizer(args.optim, device)
+    print(f"Optimizer: {optim}")
+    
+    # TorchInductor fuses pointwise ops into generated kernels; opt-in because compile time
+    # exceeds the whole training run on typical 20-50 example feedback sets
+    use_compile = args.compile
+    if use_compile and not hasattr(torch, 'compile'):
+        print("⚠️  torch.compile requires PyTorch 2.0+, running eagerly")
+        use_compile = False
+    
+    # Trade an extra forward pass for activation memory so larger batches fit in VRAM
+    grad_checkpoint = args.grad_checkpoint if args.grad_checkpoint is not None else device == 'cuda'
+    
     # Load base model
     base_model = "mohameddhiab/humor-no-humor"
     print(f"\nLoading base model: {base_model}")
     
     tokenizer = AutoTokenizer.from_pretrained(base_model)
-    model = AutoModelForSequenceClassification.from_pretrained(
-        base_model,
+    model_kwargs = dict(
         num_labels=2,
         id2label={0: "NO_HUMOR", 1: "HUMOR"},
         label2id={"NO_HUMOR": 0, "HUMOR": 1}
     )
+    try:
+        model = AutoModelForSequenceClassification.from_pretrained(
+            base_model,
+            attn_implementation=attn_implementation,
+            **model_kwargs
+        )
+    except ValueError as e:
+        # Older transformers releases don't support SDPA/FlashAttention-2 for every architecture
+        if attn_implementation is None:
+            raise
+        print(f"⚠️  {attn_implementation} attention not supported ({e}), using eager")
+        model = AutoModelForSequenceClassification.from_pretrained(
+            base_model,
+            attn_implementation="eager",
+            **model_kwargs
+        )
     
-    # Load training data
-    print(f"\nLoading training data: {args.data}")
-    data = load_training_data(args.data)
-    print(f"  Total examples: {len(data)}")
-    
-    positive = sum(1 for d in data if d['label'] == 1)
-    negative = len(data) - positive
-    print(f"  Positive (HUMOR): {positive}")
-    print(f"  Negative (NO_HUMOR): {negative}")
-    print(f"  Class ratio: {positive/negative:.2f}:1")
-    
-    # Prepare datasets
-    print("\nPreparing datasets...")
-    train_dataset, val_dataset = prepare_dataset(data, tokenizer)
-    print(f"  Training samples: {len(train_dataset)}")
-    print(f"  Validation samples: {len(val_dataset)}")
+    freeze = args.freeze_encoder or args.unfreeze_top_n > 0
+    grad_checkpoint_kwargs = None
+    if freeze:
+        trainable, total = freeze_encoder(model, args.unfreeze_top_n)
+        print(f"  Frozen encoder (top {args.unfreeze_top_n} layers trainable): "
+              f"{trainable:,} / {total:,} parameters trainable")
+        if args.unfreeze_top_n == 0:
+            # Head-only training never backpropagates into the encoder, so there is nothing to checkpoint
+            grad_checkpoint = False
+        elif grad_checkpoint:
+            # Non-reentrant checkpointing works without the frozen embeddings requiring grad,
+            # so the backward pass stops at the first trainable layer
+            grad_checkpoint_kwargs = {"use_reentrant": False}
+    elif args.lora:
+        if grad_checkpoint:
+            # Checkpointed layers need an input that requires grad once embeddings are frozen
+            model.enable_input_require_grads()
+        model = apply_lora(model, args.lora_r)
+        trainable, total = model.get_nb_trainable_parameters()
+        print(f"  LoRA adapters (r={args.lora_r}): {trainable:,} / {total:,} parameters trainable")
     
     # Training arguments
     output_dir = args.output
@@ -160,27 +507,87 @@ def main():
         num_train_epochs=args.epochs,
         per_device_train_batch_size=args.batch_size,
         per_device_eval_batch_size=args.batch_size,
+        gradient_accumulation_steps=args.grad_accum,
+        gradient_checkpointing=grad_checkpoint,
+        gradient_checkpointing_kwargs=grad_checkpoint_kwargs,
+        # Batch similar lengths together to minimize padding (replaced by the weighted sampler
+        # when balancing classes)
+        group_by_length=not args.balance_classes,
         learning_rate=args.learning_rate,
+        optim=optim,
         weight_decay=0.01,
-        eval_strategy="epoch",
-        save_strategy="epoch",
+        eval_strategy="steps" if args.eval_steps else "epoch",
+        eval_steps=args.eval_steps,
+        save_strategy="steps" if args.eval_steps else "epoch",
+        save_steps=args.eval_steps,
         load_best_model_at_end=True,
         metric_for_best_model="f1",
         logging_dir=f"{output_dir}/logs",
         logging_steps=10,
         save_total_limit=2,
         report_to="none",  # Disable wandb/tensorboard
-        use_cpu=(device == 'cpu')
+        use_cpu=(device == 'cpu'),
+        bf16=(precision == 'bf16'),
+        fp16=(precision == 'fp16'),
+        dataloader_pin_memory=(device == 'cuda'),
+        # Worker processes only pay off when feeding GPUs; keep them alive across epochs/evals
+        dataloader_num_workers=4 if device == 'cuda' else 0,
+        dataloader_persistent_workers=(device == 'cuda'),
+        ddp_find_unused_parameters=False,
+        torch_compile=use_compile,
+        torch_compile_mode="reduce-overhead" if use_compile else None
     )
     
+    # Load training data
+    print(f"\nLoading training data: {args.data}")
+    texts, labels = load_training_data(args.data, interactive=not distributed)
+    print(f"  Total examples: {len(texts)}")
+    
+    positive = labels.count(1)
+    negative = len(labels) - positive
+    print(f"  Positive (HUMOR): {positive}")
+    print(f"  Negative (NO_HUMOR): {negative}")
+    print(f"  Class ratio: {positive/max(negative, 1):.2f}:1")
+    if not args.balance_classes and not 0.67 <= positive / max(negative, 1) <= 1.5:
+        print("  ⚠️  Imbalanced classes - consider --balance-classes")
+    
+    # Prepare datasets (rank 0 tokenizes and writes the caches first, other ranks reuse them)
+    print("\nPreparing datasets...")
+    with training_args.main_process_first(desc="dataset tokenization"):
+        if args.max_length == 'auto':
+            max_length = auto_max_length(texts, tokenizer, args.data)
+        else:
+            max_length = args.max_length
+            print(f"  Max length: {max_length}")
+        train_dataset, val_dataset = prepare_dataset(texts, labels, tokenizer, args.data, max_length)
+    print(f"  Training samples: {len(train_dataset)}")
+    print(f"  Validation samples: {len(val_dataset)}")
+    
+    if use_compile:
+        # reduce-overhead records a CUDA graph per input shape, so keep the sequence length fixed
+        data_collator = DataCollatorWithPadding(tokenizer, padding='max_length', max_length=max_length)
+    else:
+        # Pad each batch to its longest example, rounded up for tensor-core alignment
+        data_collator = DataCollatorWithPadding(tokenizer, pad_to_multiple_of=8)
+    
+    # Evaluate on a fixed random subsample during training; the full set is used at the end
+    train_eval_dataset = val_dataset
+    if len(val_dataset) > args.eval_subsample:
+        train_eval_dataset = val_dataset.shuffle(seed=42).select(range(args.eval_subsample))
+        print(f"  Evaluating on {args.eval_subsample} validation samples during training")
+    
+    sample_weights = compute_sample_weights(train_dataset) if args.balance_classes else None
+    
     # Trainer
-    trainer = Trainer(
+    trainer = BalancedTrainer(
         model=model,
         args=training_args,
         train_dataset=train_dataset,
-        eval_dataset=val_dataset,
+        eval_dataset=train_eval_dataset,
+        data_collator=data_collator,
         compute_metrics=compute_metrics,
-        callbacks=[EarlyStoppingCallback(early_stopping_patience=2)]
+        callbacks=[EarlyStoppingCallback(early_stopping_patience=2)],
+        sample_weights=sample_weights
     )
     
     # Train
@@ -188,8 +595,12 @@ def main():
     print("TRAINING")
     print("-" * 70)
     print(f"Epochs: {args.epochs}")
-    print(f"Batch size: {args.batch_size}")
+    print(f"Batch size: {args.batch_size} (x{args.grad_accum} accumulation = {args.batch_size * args.grad_accum} effective)")
+    print(f"Gradient checkpointing: {'on' if grad_checkpoint else 'off'}")
+    print(f"torch.compile: {'on' if use_compile else 'off'}")
+    print(f"Class-balanced sampling: {'on (length grouping disabled)' if args.balance_classes else 'off'}")
     print(f"Learning rate: {args.learning_rate}")
+    print(f"Precision: {precision}")
     print("\nStarting training... (this may take 5-30 minutes)\n")
     
     trainer.train()
@@ -199,7 +610,7 @@ def main():
     print("EVALUATION")
     print("-" * 70)
     
-    eval_results = trainer.evaluate()
+    eval_results = trainer.evaluate(eval_dataset=val_dataset)
     print("\nFinal validation metrics:")
     for key, value in eval_results.items():
         if key.startswith('eval_'):
@@ -211,12 +622,17 @@ def main():
     print("SAVING MODEL")
     print("-" * 70)
     
+    # With LoRA this writes only the adapter weights
     trainer.save_model(output_dir)
-    tokenizer.save_pretrained(output_dir)
+    if trainer.is_world_process_zero():
+        tokenizer.save_pretrained(output_dir)
     
-    print(f"\n✓ Fine-tuned model saved to: {output_dir}")
+    print(f"\n✓ Fine-tuned {'LoRA adapter' if args.lora else 'model'} saved to: {output_dir}")
     print("\nNext steps:")
-    print("  1. Convert to ONNX: python scripts/convert-humor-model-to-onnx.py --custom")
+    if args.lora:
+        print(f"  1. Convert to ONNX: python scripts/convert-humor-model-to-onnx.py --lora-path {output_dir}")
+    else:
+        print("  1. Convert to ONNX: python scripts/convert-humor-model-to-onnx.py --custom")
     print("  2. Test with: node src/scripts/testHumorScorer.ts")
     print("  3. Deploy: .\\scripts\\restart-clean.ps1")
     
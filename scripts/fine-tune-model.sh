@@ -0,0 +1,13 @@
+#!/bin/bash
+
+# Fine-tune on all local GPUs with distributed data parallel (DDP)
+# Usage: scripts/fine-tune-model.sh [fine-tune-model.py options]
+#        NGPU=2 scripts/fine-tune-model.sh --epochs 5
+
+NGPU=${NGPU:-$(nvidia-smi --list-gpus 2>/dev/null | wc -l)}
+if [ "$NGPU" -lt 1 ]; then
+    echo "No GPUs found, running single-process on CPU"
+    exec python scripts/fine-tune-model.py "$@"
+fi
+
+exec torchrun --nproc_per_node="$NGPU" scripts/fine-tune-model.py --gpu "$@"